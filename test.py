@@ -1,84 +1,430 @@
 import pandas as pd
 import numpy as np
+import argparse
 import glob
+import logging
+import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from itertools import combinations
 
+import ahocorasick
+import xxhash
+from numba import njit
+from rapidfuzz import fuzz, process
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = '/tmp/cache'
+
+def _read_cached(path, reader):
+    """Read `path` through a parquet cache keyed on the source file's content hash.
+
+    The first run parses and cleans the file with `reader` and persists the
+    result; later runs over an unchanged source load the parquet directly.
+    """
+    with open(path, 'rb') as f:
+        digest = xxhash.xxh64(f.read()).hexdigest()
+    cache_path = os.path.join(CACHE_DIR, f'{digest}.parquet')
+    if os.path.exists(cache_path):
+        return pd.read_parquet(cache_path, engine='pyarrow')
+    df = reader(path)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    df.to_parquet(cache_path, engine='pyarrow')
+    return df
+
+def _load_bank(path):
+    bank_df = pd.read_csv(path, usecols=['DESCRIPTION', 'AMOUNT', 'TRAN TYPE'])
+    # Integer cents drive all equality, hashing, and subset-sum work; the floats
+    # stay around for display only.
+    bank_df['AMOUNT_C'] = np.rint(bank_df['AMOUNT'].to_numpy() * 100).astype(np.int64)
+    return bank_df
+
+def _load_bb(path):
+    bb_df = pd.read_excel(path, engine='calamine', sheet_name='Receivables', skiprows=5, skipfooter=7,
+                          usecols=['Counterparty.2', 'Billed'])
+    bb_df.rename(columns={'Counterparty.2': 'Counterparty', 'Billed': 'Net Billed'}, inplace=True)
+    bb_df = bb_df.query('`Net Billed` > 0', engine='numexpr')
+    bb_df['Net Billed C'] = np.rint(bb_df['Net Billed'].to_numpy() * 100).astype(np.int64)
+    return bb_df
+
+def _load_dict(path):
+    return pd.read_excel(path, engine='calamine', usecols=['Counterparty', 'Bank Statement Name'])
+
 def load_data():
     """Load bank statement, borrowing base, and dictionary files."""
     bank_files = glob.glob("/mnt/data/*Bank*.csv")
     bb_files = glob.glob("/mnt/data/*Borrowing Base*.xlsx")
     dict_files = glob.glob("/mnt/data/*dictionary*.xlsx")
-    
+
     if not bank_files or not bb_files or not dict_files:
         raise FileNotFoundError("One or more required files are missing.")
-    
-    bank_df = pd.read_csv(bank_files[0], usecols=['DESCRIPTION', 'AMOUNT', 'TRAN TYPE'])
-    bb_df = pd.read_excel(bb_files[0], sheet_name='Receivables', skiprows=5, skipfooter=7,
-                          usecols=['Counterparty.2', 'Billed'])
-    bb_df.rename(columns={'Counterparty.2': 'Counterparty', 'Billed': 'Net Billed'}, inplace=True)
-    bb_df = bb_df[bb_df['Net Billed'] > 0]
-    
-    dict_df = pd.read_excel(dict_files[0], usecols=['Counterparty', 'Bank Statement Name'])
+
+    bank_df = _read_cached(bank_files[0], _load_bank)
+    bb_df = _read_cached(bb_files[0], _load_bb)
+    dict_df = _read_cached(dict_files[0], _load_dict)
     name_dict = dict_df.set_index('Counterparty')['Bank Statement Name'].to_dict()
-    
+
     return bank_df, bb_df, name_dict
 
 def preprocess_data(bank_df, bb_df, name_dict):
-    """Standardize names and apply dictionary mapping."""
+    """Standardize names, apply dictionary mapping, and compile the statement-name automaton."""
     bb_df['Statement Name'] = bb_df['Counterparty'].map(name_dict).fillna(bb_df['Counterparty'])
-    
-    bank_df['DESCRIPTION'] = bank_df['DESCRIPTION'].str.upper()
-    bb_df['Statement Name'] = bb_df['Statement Name'].str.upper()
-    
-    return bank_df, bb_df
-
-def find_best_match(transactions, target_amount, tolerance=5.0):
-    """Find a combination of transactions that sum to the target amount within a given tolerance."""
-    amounts = transactions['AMOUNT'].tolist()
-    
-    for r in range(1, len(amounts) + 1):
-        for combo in combinations(amounts, r):
-            total = sum(combo)
-            if abs(total - target_amount) <= tolerance:
-                return combo
-    return None
-
-def reconcile(bank_df, bb_df):
+
+    # Arrow-backed strings run upper/contains/split in C++ compute kernels and
+    # store the column without a per-string PyObject header.
+    bank_df['DESCRIPTION'] = bank_df['DESCRIPTION'].astype('string[pyarrow]').str.upper()
+    bb_df['Statement Name'] = bb_df['Statement Name'].astype('string[pyarrow]').str.upper()
+
+    automaton = ahocorasick.Automaton()
+    for name in bb_df['Statement Name'].dropna().unique():
+        automaton.add_word(name, name)
+    automaton.make_automaton()
+
+    return bank_df, bb_df, automaton
+
+MITM_MAX_N = 30
+BITSET_TARGET_CAP = 5_000_000  # cents; the DP bitset costs O(n * target/64) words
+
+def _subset_sum_feasible(amounts_cents, target_cents, tol_cents):
+    """Pseudo-polynomial feasibility test: can any subset land within tolerance?
+
+    Uses a Python int as the DP bitset — bit s of `reachable` means some subset
+    sums to s — so each amount folds in with one shift-OR over the whole set.
+    """
+    limit = target_cents + tol_cents
+    if limit <= 0:
+        return False
+    full = (1 << (limit + 1)) - 1
+    reachable = 1
+    for a in amounts_cents:
+        if 0 < a <= limit:
+            reachable = (reachable | (reachable << int(a))) & full
+    lo = max(target_cents - tol_cents, 0)
+    window = reachable >> lo
+    if lo == 0:
+        window &= ~1  # the empty subset does not count as a match
+    return window & ((1 << (limit - lo + 1)) - 1) != 0
+
+def _half_sums(amounts_cents):
+    """Enumerate every subset of `amounts_cents` as (sum, bitmask) arrays sorted by sum."""
+    n = len(amounts_cents)
+    sums = np.zeros(2 ** n, dtype=np.int64)
+    masks = np.zeros(2 ** n, dtype=np.int64)
+    pos = 1
+    for r in range(1, n + 1):
+        for combo in combinations(range(n), r):
+            total = 0
+            mask = 0
+            for i in combo:
+                total += amounts_cents[i]
+                mask |= 1 << i
+            sums[pos] = total
+            masks[pos] = mask
+            pos += 1
+    order = np.argsort(sums, kind='stable')
+    return sums[order], masks[order]
+
+@njit(cache=True)
+def _subset_sum_dfs(amts, target, tol, max_k, prune):
+    """Iterative include-first DFS over int64 cent amounts; returns the selection as bools.
+
+    With prune set, branches are cut three ways: a prefix that overshoots
+    target+tol, a branch already holding max_k picks, and a branch whose
+    remaining suffix sum cannot reach the target. The overshoot and suffix cuts
+    assume strictly positive amounts; callers pass prune=False when the bucket
+    holds debits, which degrades to an exhaustive DFS but stays correct.
+    Compiled in nopython mode, so only plain numpy arrays and scalars cross the
+    boundary. An empty result array signals no subset fits.
+    """
+    n = amts.shape[0]
+    suffix = np.zeros(n + 1, dtype=np.int64)
+    for k in range(n - 1, -1, -1):
+        suffix[k] = suffix[k + 1] + amts[k]
+    choice = np.zeros(n, dtype=np.int8)  # 0 untried, 1 included, 2 excluded
+    remaining = target
+    picked = 0
+    i = 0
+    while True:
+        while i < n and picked < max_k and (not prune or remaining <= suffix[i] + tol):
+            choice[i] = 1
+            remaining -= amts[i]
+            picked += 1
+            i += 1
+            if -tol <= remaining <= tol:
+                return choice == 1
+            if prune and remaining < -tol:
+                break
+        while True:
+            i -= 1
+            if i < 0:
+                return np.zeros(0, dtype=np.bool_)
+            if choice[i] == 1:
+                remaining += amts[i]
+                picked -= 1
+                choice[i] = 2
+                i += 1
+                break
+            choice[i] = 0
+
+def _branch_and_bound(amounts_cents, target_cents, tol_cents):
+    """Fallback for large n: JIT-compiled DFS over amounts sorted descending."""
+    order = np.argsort(amounts_cents)[::-1]
+    amts = np.ascontiguousarray(amounts_cents[order])
+    min_amt = int(amts[-1]) if amts.shape[0] else 0
+    if min_amt > 0:
+        max_k = min(amts.shape[0], (target_cents + tol_cents) // min_amt + 1)
+    else:
+        max_k = amts.shape[0]
+    # The overshoot/suffix cuts are only sound when every amount is positive.
+    selected = _subset_sum_dfs(amts, target_cents, tol_cents, max_k, min_amt > 0)
+    mask = 0
+    for k in np.nonzero(selected)[0]:
+        mask |= 1 << int(order[k])
+    return mask
+
+def find_best_match(amounts_cents, target_cents, tolerance_cents=500):
+    """Find a combination of integer-cent amounts that sums to the target within a tolerance.
+
+    Returns the positional indices of the chosen entries in `amounts_cents`,
+    or None when no combination lands inside the tolerance.
+
+    Uses meet-in-the-middle: amounts are split in half, the 2^(n/2) partial sums of each
+    half are enumerated, and each left sum is matched against the sorted right sums with a
+    vectorized binary search. Integer cents keep the arithmetic exact.
+    """
+    amounts_cents = np.asarray(amounts_cents, dtype=np.int64)
+    target_cents = int(target_cents)
+    tol_cents = int(tolerance_cents)
+    n = len(amounts_cents)
+
+    if n == 0:
+        return None
+
+    # Cheap word-parallel DP rules out hopeless buckets before any enumeration,
+    # as long as amounts are positive and the bitset stays a few hundred KB.
+    if (target_cents + tol_cents <= BITSET_TARGET_CAP and amounts_cents.min() > 0
+            and not _subset_sum_feasible(amounts_cents, target_cents, tol_cents)):
+        return None
+
+    if n > MITM_MAX_N:
+        mask = _branch_and_bound(amounts_cents, target_cents, tol_cents)
+    else:
+        half = n // 2
+        left_sums, left_masks = _half_sums(amounts_cents[:half])
+        right_sums, right_masks = _half_sums(amounts_cents[half:])
+
+        lo = np.searchsorted(right_sums, target_cents - left_sums - tol_cents, side='left')
+        hi = np.searchsorted(right_sums, target_cents - left_sums + tol_cents, side='right')
+
+        mask = 0
+        # Skip the empty-on-both-sides pairing (mask 0/0), which trivially "matches" target 0.
+        for i in np.nonzero(hi > lo)[0]:
+            for j in range(lo[i], hi[i]):
+                if left_masks[i] or right_masks[j]:
+                    mask = int(left_masks[i]) | (int(right_masks[j]) << half)
+                    break
+            if mask:
+                break
+
+    if not mask:
+        return None
+    return np.array([i for i in range(n) if mask & (1 << i)], dtype=np.intp)
+
+def _combo_worker(amt_c, jobs):
+    """Propose a combination for each (bb_idx, target, candidate rows) job.
+
+    Runs in a worker process against a read-only snapshot of the bank amounts;
+    conflicting proposals are resolved by the parent after all workers return.
+    """
+    out = []
+    for bb_idx, target_c, cand in jobs:
+        cand = np.asarray(cand, dtype=np.intp)
+        positions = find_best_match(amt_c[cand], target_c)
+        out.append((bb_idx, None if positions is None else cand[positions]))
+    return out
+
+FUZZY_THRESHOLD = 85
+
+# Fuzzy results per normalized name, misses included, so names repeating across
+# reconcile calls (e.g. the same counterparty over several months) never rescore.
+_fuzzy_memo = {}
+
+# Token-sort keys per raw string, so a description seen in an earlier batch is
+# never re-tokenized and re-sorted.
+_token_sort_keys = {}
+
+def _normalize_name(name):
+    return " ".join(name.upper().split())
+
+def _token_sort_key(text):
+    key = _token_sort_keys.get(text)
+    if key is None:
+        key = " ".join(sorted(text.split()))
+        _token_sort_keys[text] = key
+    return key
+
+def fuzzy_match_names(names, descriptions, threshold=FUZZY_THRESHOLD):
+    """Pick the best fuzzy bank description per statement name in one batched score matrix.
+
+    Token-sort keys are computed once per side, so the scorer is a plain ratio over
+    presorted tokens instead of re-tokenizing and re-sorting on every comparison.
+    Hits and misses are memoized on the normalized name for the life of the process.
+    """
+    result = {}
+    todo = []
+    for name in names:
+        key = _normalize_name(name)
+        if key in _fuzzy_memo:
+            result[name] = _fuzzy_memo[key]
+        else:
+            todo.append(name)
+
+    if todo:
+        name_keys = [_token_sort_key(name) for name in todo]
+        desc_keys = [_token_sort_key(desc) for desc in descriptions]
+        # workers=-1 scores rows on rapidfuzz's C++ thread pool, outside the GIL;
+        # score_cutoff lets the scorer abort pairs that can no longer qualify.
+        scores = process.cdist(name_keys, desc_keys, scorer=fuzz.ratio,
+                               score_cutoff=threshold, dtype=np.uint8, workers=-1)
+        best = scores.argmax(axis=1)
+        for i, (name, j) in enumerate(zip(todo, best)):
+            hit = descriptions[j] if scores[i, j] >= threshold else None
+            result[name] = hit
+            _fuzzy_memo[_normalize_name(name)] = hit
+
+    return result
+
+def reconcile(bank_df, bb_df, automaton):
     """Match borrowing base receivables to bank transactions with variance handling."""
-    bank_df['Matched'] = False
-    results = []
-    
-    for _, ar in bb_df.iterrows():
-        match_row = {'Counterparty': ar['Counterparty'], 'Net Billed': ar['Net Billed'], 'Matched Amount': np.nan, 'Transactions': 'No Match'}
-        
-        possible_transactions = bank_df[bank_df['DESCRIPTION'].str.contains(ar['Statement Name'], na=False, case=False)]
-        
-        if not possible_transactions.empty:
-            match = possible_transactions[possible_transactions['AMOUNT'] == ar['Net Billed']]
-            if not match.empty:
-                row = match.iloc[0]
-                match_row.update({'Matched Amount': row['AMOUNT'], 'Transactions': row['DESCRIPTION']})
-                bank_df.loc[row.name, 'Matched'] = True
-            else:
-                matched_combo = find_best_match(possible_transactions, ar['Net Billed'])
-                if matched_combo:
-                    match_row.update({'Matched Amount': sum(matched_combo), 'Transactions': f"Multiple: {matched_combo}"})
-                    bank_df = bank_df[~bank_df['AMOUNT'].isin(matched_combo)]
-        
-        results.append(match_row)
-    
-    return pd.DataFrame(results)
+    bank_df = bank_df.reset_index(drop=True)
+    bb_df = bb_df.reset_index(drop=True)
+
+    # Candidate pairing is a single linear scan: the automaton walks each
+    # description once and emits every statement name it contains, restoring
+    # substring semantics without a per-receivable pass over the column.
+    # Blank descriptions scan as '' (the baseline's str.contains used na=False).
+    hit_pairs = set()
+    for desc_idx, desc in enumerate(bank_df['DESCRIPTION'].fillna('').values):
+        for _, name in automaton.iter(desc):
+            hit_pairs.add((name, desc_idx))
+    hits = pd.DataFrame(sorted(hit_pairs), columns=['Statement Name', 'BANK_IDX'])
+
+    candidates = bb_df.reset_index().rename(columns={'index': 'BB_IDX'})
+    candidates = candidates.merge(hits, on='Statement Name')
+    candidates = candidates.merge(bank_df[['AMOUNT_C']], left_on='BANK_IDX', right_index=True)
+
+    # Group candidate rows by (statement name, cent amount) once so the
+    # exact-amount match per receivable is a dict lookup instead of a mask.
+    lookup = defaultdict(list)
+    for name, amount_c, bank_idx in candidates[['Statement Name', 'AMOUNT_C', 'BANK_IDX']].itertuples(index=False, name=None):
+        lookup[(name, amount_c)].append(bank_idx)
+
+    cand_by_bb = candidates.groupby('BB_IDX')['BANK_IDX'].unique().to_dict()
+    used = np.zeros(len(bank_df), dtype=np.bool_)
+
+    # Pull the hot columns into plain numpy arrays once; every row access in the
+    # loop below is then an integer index instead of a pandas __getitem__.
+    desc = bank_df['DESCRIPTION'].fillna('').to_numpy()
+    amt = bank_df['AMOUNT'].to_numpy(dtype=np.float64)
+    amt_c = bank_df['AMOUNT_C'].to_numpy()
+
+    # Names the automaton never saw anywhere get one batched fuzzy pass rather
+    # than a per-receivable extractOne call.
+    hit_name_set = set(hits['Statement Name'])
+    missed_names = [name for name in bb_df['Statement Name'].dropna().unique() if name not in hit_name_set]
+    descriptions = bank_df['DESCRIPTION'].dropna().unique().tolist()
+    fuzzy_by_name = fuzzy_match_names(missed_names, descriptions) if missed_names and descriptions else {}
+
+    # Preallocated typed output columns; the result frame is assembled once at
+    # the end instead of letting pandas infer dtypes from a list of dicts.
+    n_bb = len(bb_df)
+    out_matched = np.full(n_bb, np.nan)
+    out_trans = np.full(n_bb, 'No Match', dtype=object)
+
+    pending = []
+
+    bb_rows = bb_df[['Counterparty', 'Net Billed', 'Net Billed C', 'Statement Name']]
+    for bb_idx, (counterparty, net_billed, net_billed_c, name) in enumerate(bb_rows.itertuples(index=False, name=None)):
+        logger.debug("Checking counterparty %s | %s", counterparty, net_billed)
+
+        exact_idx = None
+        for bank_idx in lookup.get((name, net_billed_c), ()):
+            if not used[bank_idx]:
+                exact_idx = bank_idx
+                break
+
+        if exact_idx is not None:
+            out_matched[bb_idx] = amt[exact_idx]
+            out_trans[bb_idx] = desc[exact_idx]
+            used[exact_idx] = True
+        elif bb_idx in cand_by_bb:
+            # Combination searches are the compute-bound part; defer them so
+            # they can run in parallel once the cheap passes have settled.
+            pending.append((bb_idx, net_billed_c))
+        else:
+            fuzzy_desc = fuzzy_by_name.get(name)
+            if fuzzy_desc is not None:
+                rows = np.nonzero((desc == fuzzy_desc) & (amt_c == net_billed_c) & ~used)[0]
+                if rows.size:
+                    out_matched[bb_idx] = amt[rows[0]]
+                    out_trans[bb_idx] = f"Fuzzy: {fuzzy_desc}"
+                    used[rows[0]] = True
+
+    if pending:
+        targets = dict(pending)
+        jobs = [(bb_idx, target_c, [idx for idx in cand_by_bb[bb_idx] if not used[idx]])
+                for bb_idx, target_c in pending]
+        n_workers = os.cpu_count() or 1
+        chunk = max(1, len(jobs) // n_workers)
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            futures = [pool.submit(_combo_worker, amt_c, jobs[k:k + chunk])
+                       for k in range(0, len(jobs), chunk)]
+            proposals = [p for f in futures for p in f.result()]
+
+        # Workers proposed against a frozen 'used' snapshot; assign greedily by
+        # receivable size and recompute serially where proposals collide.
+        proposals.sort(key=lambda p: targets[p[0]], reverse=True)
+        for bb_idx, combo_rows in proposals:
+            if combo_rows is None:
+                continue
+            combo_rows = np.asarray(combo_rows, dtype=np.intp)
+            if used[combo_rows].any():
+                free_idx = np.array([idx for idx in cand_by_bb[bb_idx] if not used[idx]], dtype=np.intp)
+                positions = find_best_match(amt_c[free_idx], targets[bb_idx])
+                if positions is None:
+                    continue
+                combo_rows = free_idx[positions]
+            matched_combo = tuple(amt[combo_rows].tolist())
+            out_matched[bb_idx] = sum(matched_combo)
+            out_trans[bb_idx] = f"Multiple: {matched_combo}"
+            used[combo_rows] = True
+
+    bank_df['Matched'] = used
+    return pd.DataFrame({
+        'Counterparty': bb_df['Counterparty'].to_numpy(dtype=object),
+        'Net Billed': bb_df['Net Billed'].to_numpy(dtype=np.float64),
+        'Matched Amount': out_matched,
+        'Transactions': out_trans,
+    })
 
 def save_results(df):
     """Save reconciliation results to an Excel file."""
     output_file = '/mnt/data/Result.xlsx'
-    df.to_excel(output_file, index=False, sheet_name='AR Rec')
-    print("Reconciliation complete. Results saved to", output_file)
+    with pd.ExcelWriter(output_file, engine='xlsxwriter') as writer:
+        df.to_excel(writer, index=False, sheet_name='AR Rec')
+    logger.info("Reconciliation complete. Results saved to %s", output_file)
 
 def main():
+    parser = argparse.ArgumentParser(description='Reconcile borrowing base receivables against bank transactions.')
+    parser.add_argument('--verbose', action='store_true', help='log per-receivable matching diagnostics')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format='%(levelname)s %(message)s')
+
     bank_df, bb_df, name_dict = load_data()
-    bank_df, bb_df = preprocess_data(bank_df, bb_df, name_dict)
-    results_df = reconcile(bank_df, bb_df)
+    bank_df, bb_df, automaton = preprocess_data(bank_df, bb_df, name_dict)
+    results_df = reconcile(bank_df, bb_df, automaton)
     save_results(results_df)
 
 if __name__ == "__main__":